@@ -5,18 +5,71 @@ Run locally: streamlit run app.py
 Deploy: Push to GitHub, connect to Streamlit Cloud
 """
 
+import io
+
 import streamlit as st
 import pandas as pd
+import xlsxwriter
 
 # Import core logic from utils module
 from utils import (
     is_valid_csv,
+    read_sample,
     read_orders,
     aggregate_by_date,
     generate_entries,
     OUTPUT_COLUMNS
 )
 
+# Caches are shared by all sessions and keyed on per-upload ids, so bound them
+CACHE_MAX_ENTRIES = 20
+CACHE_TTL = 3600  # seconds
+
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
+def validate(file_id: str, _uploaded_file) -> tuple[bool, str, str]:
+    """
+    Check the uploaded file once per upload (encoding and columns are detected on a sample).
+    Returns (is_valid, error_message, encoding) as is_valid_csv.
+    """
+    return is_valid_csv(read_sample(_uploaded_file))
+
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
+def process(file_id: str, _uploaded_file, encoding: str) -> tuple[int, int, pd.DataFrame, str]:
+    """
+    Run the pipeline once per uploaded file (keyed on its id, the file itself is not hashed).
+    Returns (order count, day count, journal entries, encoding actually used).
+    """
+    orders_df, used_encoding = read_orders(_uploaded_file, encoding=encoding)
+    daily_df = aggregate_by_date(orders_df)
+    entries_df = generate_entries(daily_df)
+    return len(orders_df), len(daily_df), entries_df, used_encoding
+
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
+def to_excel(entries_df: pd.DataFrame) -> bytes:
+    """
+    Build the downloadable Excel file (cached so download clicks don't rebuild it).
+    Columns are written directly with xlsxwriter, skipping pandas' per-cell Excel formatter.
+    """
+    output = io.BytesIO()
+    workbook = xlsxwriter.Workbook(output, {"in_memory": True})
+    worksheet = workbook.add_worksheet("Journal")
+    
+    # Same header style as DataFrame.to_excel under pandas 2.x
+    header_format = workbook.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+    worksheet.write_row(0, 0, entries_df.columns, header_format)
+    
+    # Missing amounts (NaN) become None, which xlsxwriter leaves as empty cells
+    for col, name in enumerate(entries_df.columns):
+        values = entries_df[name].astype(object).where(entries_df[name].notna(), None)
+        worksheet.write_column(1, col, values.tolist())
+    
+    workbook.close()
+    return output.getvalue()
+
+
 st.set_page_config(page_title="Martha la Compta", page_icon="📊", layout="centered")
 
 st.title(":nerd_face: Martha la Compta ")
@@ -28,43 +81,26 @@ uploaded_file = st.file_uploader("Ajoute l'export Shopify (CSV)", type=["csv"])
 
 if uploaded_file:
 
-    # Read file content once
-    content_bytes = uploaded_file.getvalue()
-    
-    # Check if the file is a valid CSV
-    is_valid, error_msg, detected_encoding = is_valid_csv(content_bytes)
+    # Check if the file is a valid CSV (cached per upload like the processing below)
+    is_valid, error_msg, detected_encoding = validate(uploaded_file.file_id, uploaded_file)
     
     if not is_valid:
         st.error(f"❌ Fichier invalide: {error_msg}")
         st.stop()
     
 
-    # Save to temp file for processing
-    import tempfile
-    with tempfile.NamedTemporaryFile(mode="w", suffix=".csv", delete=False, encoding=detected_encoding) as tmp:
-        content_str = content_bytes.decode(detected_encoding)
-        tmp.write(content_str)
-        tmp_path = tmp.name
-    
-    # Process
+    # Process (pandas reads the uploaded buffer directly, results are cached across reruns)
     try:
-        orders_df = read_orders(tmp_path)
-        daily_df = aggregate_by_date(orders_df)
-        entries_df = generate_entries(daily_df)
+        order_count, day_count, entries_df, used_encoding = process(uploaded_file.file_id, uploaded_file, detected_encoding)
         
         # Success message
-        st.success(f"✓ {len(orders_df)} commandes lues · {len(daily_df)} jours · {len(entries_df)} écritures")
-        
-        # Create downloadable Excel file
-        import io
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            entries_df.to_excel(writer, index=False, sheet_name="Journal")
-        output.seek(0)
+        st.success(f"✓ {order_count} commandes lues · {day_count} jours · {len(entries_df)} écritures")
+        if used_encoding != detected_encoding:
+            st.caption(f"Fichier lu en {used_encoding} (caractères non UTF-8 après le début du fichier).")
         
         st.download_button(
             label="⬇️ Télécharger le journal",
-            data=output.getvalue(),
+            data=to_excel(entries_df),
             file_name="journal_comptable.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
         )
@@ -75,10 +111,6 @@ if uploaded_file:
         
     except Exception as e:
         st.error(f"Erreur: {e}")
-    
-    # Cleanup
-    import os
-    os.unlink(tmp_path)
 
 else:
     st.info("👆 Insère un fichier CSV exporté depuis Shopify (Commandes → Exporter)")
@@ -2,10 +2,28 @@
 Utility functions for CSV validation and order transformation processing.
 """
 
+import csv
+import numpy as np
 import pandas as pd
 from io import StringIO
-from datetime import datetime
-from decimal import Decimal, ROUND_HALF_UP
+from typing import BinaryIO
+
+
+SAMPLE_SIZE = 64 * 1024
+SNIFF_SIZE = 4 * 1024
+
+
+def read_sample(file, size: int = SAMPLE_SIZE) -> bytes:
+    """
+    Read the beginning of an uploaded file, cut after the last complete line
+    so a multi-byte character is never split. The file position is restored.
+    """
+    file.seek(0)
+    sample = file.read(size)
+    file.seek(0)
+    if len(sample) == size and (end := sample.rfind(b"\n")) != -1:
+        sample = sample[:end + 1]
+    return sample
 
 
 def is_valid_csv(content_bytes: bytes) -> tuple[bool, str, str]:
@@ -13,7 +31,7 @@ def is_valid_csv(content_bytes: bytes) -> tuple[bool, str, str]:
     Validate that the uploaded file content is a valid CSV with required columns.
     
     Args:
-        content_bytes: The file content as bytes
+        content_bytes: The file content as bytes (a sample from read_sample is enough)
     
     Returns:
         (is_valid, error_message, encoding): Tuple of boolean, error message, and detected encoding
@@ -33,18 +51,18 @@ def is_valid_csv(content_bytes: bytes) -> tuple[bool, str, str]:
         if content_str is None:
             return False, "Impossible de décoder le fichier. Vérifiez l'encodage.", "utf-8"
         
-        # Try to parse as CSV with pandas
-        # pandas can auto-detect delimiter, but we'll try common ones
-        df = None
-        for delimiter in [',', ';', '\t']:
-            try:
-                df = pd.read_csv(StringIO(content_str), delimiter=delimiter, nrows=5)
-                if len(df.columns) > 1:  # Valid CSV should have multiple columns
-                    break
-            except (pd.errors.ParserError, ValueError):
-                continue
+        # Sniff the delimiter on the first lines, then parse only a few rows with pandas
+        try:
+            delimiter = csv.Sniffer().sniff(content_str[:SNIFF_SIZE], delimiters=",;\t").delimiter
+        except csv.Error:
+            delimiter = ","
         
-        if df is None or len(df.columns) < 2:
+        try:
+            df = pd.read_csv(StringIO(content_str), delimiter=delimiter, nrows=5)
+        except (pd.errors.ParserError, ValueError):
+            df = None
+        
+        if df is None or len(df.columns) < 2:  # Valid CSV should have multiple columns
             return False, "Le fichier ne semble pas être un CSV valide (pas assez de colonnes).", detected_encoding
         
         # Check for required columns (at minimum, we need "Name" column)
@@ -76,6 +94,15 @@ ACCOUNTS = {
     "shipping":    ("708500011", "Ports et frais accessoires factures"),
 }
 
+# Shopify export columns needed to build the journal
+INPUT_COLUMNS = [
+    "Name", "Paid at", "Created at", "Total", "Shipping",
+    "Tax 1 Name", "Tax 1 Value", "Tax 2 Name", "Tax 2 Value"
+]
+
+# Tax names matching this pattern are the reduced 5,5% rate, others are 20%
+REDUCED_RATE_PATTERN = "5[,.]5"
+
 OUTPUT_COLUMNS = [
     "N° Compte", "Journal", "Date écriture", "Commentaire",
     "Montant débit", "Montant crédit", "N° Pièce", "Date échéance", "Lettrage"
@@ -86,149 +113,173 @@ OUTPUT_COLUMNS = [
 # CORE LOGIC
 # =============================================================================
 
-def read_orders(csv_path: str) -> pd.DataFrame:
-    """Read CSV and extract order totals (first row of each order has the data)."""
-    df = pd.read_csv(csv_path, encoding="utf-8")
+def read_export_columns(source: str | BinaryIO, encoding: str = "utf-8") -> tuple[pd.DataFrame, str]:
+    """
+    Read only the columns we use, as strings (amounts are parsed by read_orders).
+    The encoding is detected on a sample of the file, so if a UTF-8 read fails further
+    down the file, it is read again as latin-1 (like the full-file detection would pick).
+    Returns (DataFrame, encoding actually used).
+    """
+    try:
+        return read_csv_columns(source, encoding), encoding
+    except UnicodeDecodeError:
+        if encoding not in ("utf-8", "utf-8-sig"):
+            raise
+        return read_csv_columns(source, "latin-1"), "latin-1"
+
+
+def read_csv_columns(source: str | BinaryIO, encoding: str) -> pd.DataFrame:
+    """
+    Read the INPUT_COLUMNS of the CSV as strings.
+    Uses the multi-threaded pyarrow parser, falling back to the default C parser
+    when pyarrow is not installed or the file doesn't suit it (e.g. missing tax columns).
+    """
+    if hasattr(source, "seek"):
+        source.seek(0)
+    try:
+        return pd.read_csv(source, encoding=encoding, engine="pyarrow", usecols=INPUT_COLUMNS, dtype="string[pyarrow]")
+    except (ImportError, KeyError, ValueError):
+        if hasattr(source, "seek"):
+            source.seek(0)
+        return pd.read_csv(source, encoding=encoding, usecols=lambda col: col in INPUT_COLUMNS, dtype=str)
+
+
+def read_orders(source: str | BinaryIO, encoding: str = "utf-8") -> tuple[pd.DataFrame, str]:
+    """
+    Read CSV (path or binary file-like object) and extract order totals
+    (first row of each order has the data).
+    Amounts are returned as nullable integer cents (Int64).
+    Returns (orders, encoding actually used to read the file).
+    """
+    df, encoding = read_export_columns(source, encoding)
     
-    # Keep only first row per order (drop duplicates on Name)
-    df = df[df["Name"].notna() & (df["Name"].str.strip() != "")].drop_duplicates(subset="Name", keep="first")
+    # Keep only first row per order (drop duplicates on Name), skipping blank names
+    has_name = df["Name"].str.contains(r"\S", na=False, regex=True)
+    df = df.loc[has_name].drop_duplicates(subset="Name", keep="first")
     
     # Parse dates (use "Paid at" or fallback to "Created at")
     date_col = df["Paid at"].fillna(df["Created at"])
     df["date"] = pd.to_datetime(date_col.str[:10], format="%Y-%m-%d", errors="coerce")
     
-    # Parse amounts (replace comma with dot, convert to float)
+    # Parse amounts (replace comma with dot, convert to integer cents).
+    # Missing amounts stay <NA> and count as 0 in the sums below.
     for col in ["Total", "Shipping", "Tax 1 Value", "Tax 2 Value"]:
-        df[col] = pd.to_numeric(df[col].astype(str).str.replace(",", "."), errors="coerce").fillna(0)
+        euros = pd.to_numeric(df[col].str.replace(",", ".", regex=False), errors="coerce")
+        df[col] = (euros * 100).round().astype("Int64")
     
-    # Calculate TVA amounts
-    df["tva_20"] = 0.0
-    df["tva_55"] = 0.0
+    # Calculate TVA amounts on NumPy arrays (one row per tax column)
+    tax_ids = [i for i in [1, 2] if f"Tax {i} Name" in df.columns]
+    is_reduced = np.zeros((len(tax_ids), len(df)), dtype=bool)
+    tax_values = np.zeros((len(tax_ids), len(df)), dtype="int64")
+    for row, i in enumerate(tax_ids):
+        is_reduced[row] = df[f"Tax {i} Name"].str.contains(REDUCED_RATE_PATTERN, na=False, regex=True).to_numpy(dtype=bool)
+        tax_values[row] = df[f"Tax {i} Value"].to_numpy(dtype="int64", na_value=0)
     
-    for i in [1, 2]:
-        tax_name_col = f"Tax {i} Name"
-        tax_value_col = f"Tax {i} Value"
-        if tax_name_col in df.columns:
-            is_reduced = df[tax_name_col].astype(str).str.contains("5[,.]5", na=False, regex=True)
-            df["tva_55"] += df[tax_value_col].where(is_reduced, 0)
-            df["tva_20"] += df[tax_value_col].where(~is_reduced & (df[tax_value_col] > 0), 0)
+    df["tva_55"] = np.where(is_reduced, tax_values, 0).sum(axis=0)
+    df["tva_20"] = np.where(~is_reduced & (tax_values > 0), tax_values, 0).sum(axis=0)
     
-    return df[["Name", "date", "Total", "Shipping", "tva_20", "tva_55"]].rename(columns={"Total": "total", "Shipping": "shipping"})
+    orders = df[["Name", "date", "Total", "Shipping", "tva_20", "tva_55"]].rename(columns={"Total": "total", "Shipping": "shipping"})
+    return orders, encoding
 
 
 def aggregate_by_date(df: pd.DataFrame) -> pd.DataFrame:
     """Group orders by date, summing all amounts."""
     df = df[df["date"].notna()].copy()
-    df["date_only"] = df["date"].dt.date
+    # Keep the day as datetime64 (not Python date objects) so grouping hashes integers
+    df["date_only"] = df["date"].dt.normalize()
     
-    daily = df.groupby("date_only", as_index=False).agg({
+    daily = df.groupby("date_only", sort=False, as_index=False).agg({
         "total": "sum",
         "shipping": "sum",
         "tva_20": "sum",
         "tva_55": "sum"
     })
     
-    return daily
+    return daily.sort_values("date_only", ignore_index=True)
+
 
+def div_half_up(numerator: np.ndarray, denominator: int) -> np.ndarray:
+    """Integer division rounding halves away from zero (like ROUND_HALF_UP)."""
+    return np.sign(numerator) * ((2 * np.abs(numerator) + denominator) // (2 * denominator))
 
-def calculate_ht(row: pd.Series) -> pd.Series:
+
+def calculate_ht(daily_df: pd.DataFrame) -> pd.DataFrame:
     """
-    Calculate HT amounts from TTC values.
-    Returns Series with keys: tva_20, tva_55, sales_20, sales_55, shipping
+    Calculate HT amounts from TTC values for every day at once.
+    All amounts are integer cents.
+    Returns DataFrame with columns: tva_20, tva_55, sales_20, sales_55, shipping
     """
-    total = Decimal(str(row["total"])).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-    shipping = Decimal(str(row["shipping"])).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-    tva_20 = Decimal(str(row["tva_20"])).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-    tva_55 = Decimal(str(row["tva_55"])).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+    total = daily_df["total"].to_numpy(dtype="int64")
+    shipping = daily_df["shipping"].to_numpy(dtype="int64")
+    tva_20 = daily_df["tva_20"].to_numpy(dtype="int64")
+    tva_55 = daily_df["tva_55"].to_numpy(dtype="int64")
     
-    # Shipping HT (assuming 20% VAT)
-    shipping_ht = (shipping / Decimal("1.20")).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP) if shipping else Decimal("0")
-    shipping_tva = shipping - shipping_ht
+    # Shipping HT (assuming 20% VAT): shipping / 1.20
+    shipping_ht = div_half_up(shipping * 100, 120)
     
     # Product TVA at 20% = total TVA 20% minus shipping TVA
-    product_tva_20 = max(Decimal("0"), tva_20 - shipping_tva)
+    # (sales_20 is built in place to avoid temporary arrays)
+    sales_20 = tva_20 - (shipping - shipping_ht)
+    np.maximum(sales_20, 0, out=sales_20)
     
-    # HT from TVA amounts
-    sales_20 = (product_tva_20 / Decimal("0.20")).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP) if product_tva_20 else Decimal("0")
-    sales_55 = (tva_55 / Decimal("0.055")).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP) if tva_55 else Decimal("0")
+    # HT from TVA amounts: tva / 0.20 is exact in cents, tva / 0.055 needs rounding
+    sales_20 *= 5
+    sales_55 = div_half_up(tva_55 * 1000, 55)
     
     # Adjust for rounding to ensure balance (debit = sum of credits)
     credits = tva_20 + tva_55 + sales_20 + sales_55 + shipping_ht
-    if (diff := total - credits) != 0:
-        sales_20 += diff
-    
-    return pd.Series({
-        "tva_20": float(tva_20),
-        "tva_55": float(tva_55),
-        "sales_20": float(sales_20),
-        "sales_55": float(sales_55),
-        "shipping": float(shipping_ht)
-    })
+    sales_20 += total - credits
+    
+    return pd.DataFrame({
+        "tva_20": tva_20,
+        "tva_55": tva_55,
+        "sales_20": sales_20,
+        "sales_55": sales_55,
+        "shipping": shipping_ht
+    }, index=daily_df.index)
 
 
 def generate_entries(daily_df: pd.DataFrame) -> pd.DataFrame:
     """Generate journal entries from daily aggregated data."""
-    entries = []
-    
     # Calculate HT amounts for each day
-    amounts_df = daily_df.apply(calculate_ht, axis=1)
-    
-    # Helper to safely get scalar value
-    def get_scalar(df, idx, col):
-        val = df.at[idx, col]
-        return val.item() if hasattr(val, 'item') else float(val)
-    
-    for idx in daily_df.index:
-        date = daily_df.at[idx, "date_only"]
-        dt = datetime.combine(date, datetime.min.time())
-        date_str = dt.strftime("%d%m%y")
-        piece = f"{JOURNAL}{dt.strftime('%y%m%d')}"
-        
-        def add_entry(account_key: str, debit: float | str = "", credit: float | str = ""):
-            account, label = ACCOUNTS[account_key]
-            # Round numeric values to 2 decimal places to avoid floating point precision issues
-            def round_if_numeric(val):
-                if isinstance(val, (int, float)):
-                    return round(float(val), 2)
-                return val
-            
-            # Use None instead of empty string for numeric columns to ensure Arrow compatibility
-            debit_val = round_if_numeric(debit) if debit != "" else None
-            credit_val = round_if_numeric(credit) if credit != "" else None
-            
-            entries.append({
-                "N° Compte": account,
-                "Journal": JOURNAL,
-                "Date écriture": date_str,
-                "Commentaire": label,
-                "Montant débit": debit_val,
-                "Montant crédit": credit_val,
-                "N° Pièce": piece,
-                "Date échéance": "",
-                "Lettrage": ""
-            })
-        
-        # Debit: clients
-        total_val = get_scalar(daily_df, idx, "total")
-        add_entry("clients", debit=total_val)
-        
-        # Credits: TVA from original data, sales/shipping from calculated amounts
-        tva_20_val = get_scalar(daily_df, idx, "tva_20")
-        tva_55_val = get_scalar(daily_df, idx, "tva_55")
-        sales_55_val = get_scalar(amounts_df, idx, "sales_55")
-        sales_20_val = get_scalar(amounts_df, idx, "sales_20")
-        shipping_val = get_scalar(amounts_df, idx, "shipping")
-        
-        if tva_20_val > 0:
-            add_entry("tva_20", credit=tva_20_val)
-        if tva_55_val > 0:
-            add_entry("tva_55", credit=tva_55_val)
-        if sales_55_val > 0:
-            add_entry("sales_55", credit=sales_55_val)
-        if sales_20_val > 0:
-            add_entry("sales_20", credit=sales_20_val)
-        if shipping_val > 0:
-            add_entry("shipping", credit=shipping_val)
-    
-    return pd.DataFrame(entries, columns=OUTPUT_COLUMNS)
-
+    amounts_df = calculate_ht(daily_df)
+    
+    # Columns are handled as NumPy arrays so building the frames skips index alignment
+    date_str = daily_df["date_only"].dt.strftime("%d%m%y").to_numpy()
+    piece = (JOURNAL + daily_df["date_only"].dt.strftime("%y%m%d")).to_numpy()
+    
+    def account_entries(account_key: str, debit: np.ndarray | None = None, credit: np.ndarray | None = None) -> pd.DataFrame:
+        """Build one entry per day for the given account (credits only when positive)."""
+        account, label = ACCOUNTS[account_key]
+        keep = credit > 0 if credit is not None else np.ones(len(date_str), dtype=bool)
+        # Use NaN instead of empty string for numeric columns to ensure Arrow compatibility,
+        # amounts are converted from cents to euros only here
+        return pd.DataFrame({
+            "N° Compte": account,
+            "Journal": JOURNAL,
+            "Date écriture": date_str[keep],
+            "Commentaire": label,
+            "Montant débit": debit[keep] / 100 if debit is not None else np.nan,
+            "Montant crédit": credit[keep] / 100 if credit is not None else np.nan,
+            "N° Pièce": piece[keep],
+            "Date échéance": "",
+            "Lettrage": ""
+        }, index=np.flatnonzero(keep))
+    
+    # Debit: clients
+    entries = [account_entries("clients", debit=daily_df["total"].to_numpy(dtype="int64"))]
+    
+    # Credits: TVA from original data, sales/shipping from calculated amounts
+    credits = {
+        "tva_20": daily_df["tva_20"].to_numpy(dtype="int64"),
+        "tva_55": daily_df["tva_55"].to_numpy(dtype="int64"),
+        "sales_55": amounts_df["sales_55"].to_numpy(),
+        "sales_20": amounts_df["sales_20"].to_numpy(),
+        "shipping": amounts_df["shipping"].to_numpy(),
+    }
+    for account_key, amounts in credits.items():
+        entries.append(account_entries(account_key, credit=amounts))
+    
+    # Stable sort on the day position keeps accounts in the order above within each day
+    entries_df = pd.concat(entries).sort_index(kind="stable").reset_index(drop=True)
+    return entries_df[OUTPUT_COLUMNS]